@@ -8,21 +8,91 @@
 from __future__ import print_function
 
 import argparse
-import math
+import collections
+import io
+import json
+import multiprocessing
 import os
 import platform
+import runpy
+import signal
 import subprocess
 import sys
+import tempfile
 import time
+import traceback
 
 
-def is_test_name(f):
-  return f.startswith('gyptest') and f.endswith('.py')
+# gyptest.py sits at the top of the gyp checkout, next to pylib/ and test/.
+_GYP_DIR = os.path.dirname(os.path.abspath(__file__))
+_PYLIB_DIR = os.path.join(_GYP_DIR, 'pylib')
+_TEST_LIB_DIR = os.path.join(_GYP_DIR, 'test', 'lib')
+
+# The formats to test on each platform when -f isn't given, keyed by a
+# prefix of sys.platform so that e.g. linux3 or freebsd11 are covered too.
+# Platforms not listed here get just 'make'.
+_PLATFORM_FORMATS = (
+  ('aix',     ['make']),
+  ('freebsd', ['make']),
+  ('openbsd', ['make']),
+  ('cygwin',  ['msvs']),
+  ('win32',   ['msvs', 'ninja']),
+  ('linux',   ['make', 'ninja']),
+
+  # TODO: Re-enable xcode-ninja.
+  # https://bugs.chromium.org/p/gyp/issues/detail?id=530
+  # ('darwin',  ['make', 'ninja', 'xcode', 'xcode-ninja']),
+  ('darwin',  ['make', 'ninja', 'xcode']),
+)
+
+
+# How long each (format, test) took on the last run, used to start the
+# slowest tests first.
+_TIMINGS_FILE = '.gyptest_timings.json'
+
+# The duration assumed for tests that haven't been timed yet.
+_DEFAULT_TIMING = 1.0
+
+# A test log ending in one of these isn't shown, so it isn't worth reading.
+_QUIET_ENDINGS = (b'PASSED\n', b'NO RESULT\n')
+
+# Version control directories never contain tests worth running.
+_SKIPPED_DIRS = ('.svn', '.git')
 
 
-def find_all_gyptest_files(directory):
+def is_test_name(f):
+  # Slicing is a little cheaper than the startswith()/endswith() method
+  # calls, and this runs for every file under the test directory.
+  return f[:7] == 'gyptest' and f[-3:] == '.py'
+
+
+def _scan_gyptest_files(directory, scandir):
+  with scandir(directory) as entries:
+    for entry in entries:
+      if entry.name in _SKIPPED_DIRS:
+        continue
+      # DirEntry caches the file type from the directory listing, so this
+      # doesn't need a stat() per entry the way os.walk() does.
+      if entry.is_dir(follow_symlinks=False):
+        for path in _scan_gyptest_files(entry.path, scandir):
+          yield path
+      elif entry.is_file(follow_symlinks=False) and is_test_name(entry.name):
+        yield entry.path
+
+
+def find_all_gyptest_files(directory, _scandir=getattr(os, 'scandir', None)):
+  """Returns the sorted paths of all the tests under directory.
+
+  _scandir stands in for os.scandir() so that unit tests can pass a fake
+  file system.
+  """
+  if _scandir:
+    return sorted(_scan_gyptest_files(directory, _scandir))
+
+  # os.scandir() is new in python 3.5.
   result = []
   for root, dirs, files in os.walk(directory):
+    dirs[:] = [d for d in dirs if d not in _SKIPPED_DIRS]
     result.extend([ os.path.join(root, f) for f in files if is_test_name(f) ])
   result.sort()
   return result
@@ -41,6 +111,12 @@ def main(argv=None):
       help="run tests with the specified formats")
   parser.add_argument("-G", '--gyp_option', action="append", default=[],
       help="Add -G options to the gyp command line")
+  parser.add_argument("-j", "--jobs", type=int,
+      default=multiprocessing.cpu_count(),
+      help="number of tests to run in parallel (-j1 runs them serially)")
+  parser.add_argument("--isolate", action="store_true",
+      help="run each test in its own python process instead of reusing "
+           "the worker's interpreter")
   parser.add_argument("-l", "--list", action="store_true",
       help="list available tests and exit")
   parser.add_argument("-n", "--no-exec", action="store_true",
@@ -58,7 +134,9 @@ def main(argv=None):
     os.chdir(args.chdir)
 
   if args.path:
-    extra_path = [os.path.abspath(p) for p in args.path]
+    # Passing the same directory twice shouldn't make $PATH longer.
+    extra_path = collections.OrderedDict.fromkeys(
+        os.path.abspath(p) for p in args.path)
     extra_path = os.pathsep.join(extra_path)
     os.environ['PATH'] = extra_path + os.pathsep + os.environ['PATH']
 
@@ -83,7 +161,7 @@ def main(argv=None):
       print(test)
     sys.exit(0)
 
-  os.environ['PYTHONPATH'] = os.path.abspath('test/lib')
+  os.environ['PYTHONPATH'] = _TEST_LIB_DIR
 
   if args.verbose:
     print_configuration_info()
@@ -91,31 +169,18 @@ def main(argv=None):
   if args.gyp_option and not args.quiet:
     print('Extra Gyp options: %s\n' % args.gyp_option)
 
-  if args.format:
-    format_list = args.format.split(',')
-  else:
-    format_list = {
-      'aix5':     ['make'],
-      'freebsd7': ['make'],
-      'freebsd8': ['make'],
-      'openbsd5': ['make'],
-      'cygwin':   ['msvs'],
-      'win32':    ['msvs', 'ninja'],
-      'linux':    ['make', 'ninja'],
-      'linux2':   ['make', 'ninja'],
-      'linux3':   ['make', 'ninja'],
-
-      # TODO: Re-enable xcode-ninja.
-      # https://bugs.chromium.org/p/gyp/issues/detail?id=530
-      # 'darwin':   ['make', 'ninja', 'xcode', 'xcode-ninja'],
-      'darwin':   ['make', 'ninja', 'xcode'],
-    }[sys.platform]
-
   gyp_options = []
   for option in args.gyp_option:
     gyp_options += ['-G', option]
 
-  runner = Runner(format_list, tests, gyp_options, args.verbose)
+  if args.format:
+    format_list = args.format.split(',')
+  else:
+    format_list = next((formats for prefix, formats in _PLATFORM_FORMATS
+                        if sys.platform.startswith(prefix)), ['make'])
+
+  runner = Runner(format_list, tests, gyp_options, args.verbose, args.jobs,
+                  args.isolate)
   runner.run()
 
   if not args.quiet:
@@ -130,12 +195,12 @@ def main(argv=None):
 def print_configuration_info():
   print('Test configuration:')
   if sys.platform == 'darwin':
-    sys.path.append(os.path.abspath('test/lib'))
+    sys.path.append(_TEST_LIB_DIR)
     import TestMac
     print('  Mac %s %s' % (platform.mac_ver()[0], platform.mac_ver()[2]))
     print('  Xcode %s' % TestMac.Xcode.Version())
   elif sys.platform == 'win32':
-    sys.path.append(os.path.abspath('pylib'))
+    sys.path.append(_PYLIB_DIR)
     import gyp.MSVSVersion
     print('  Win %s %s\n' % platform.win32_ver()[0:2])
     print('  MSVS %s' %
@@ -147,77 +212,324 @@ def print_configuration_info():
   print()
 
 
+def _pool_context():
+  """Returns the multiprocessing context to create the worker pool from.
+
+  On Linux the workers are forked from a fork server that has already
+  imported the test libraries, so each worker starts with them loaded
+  instead of importing them again on its first test.  Elsewhere, and on
+  python 2, the platform default is used.
+  """
+  if (sys.platform.startswith('linux') and
+      hasattr(multiprocessing, 'get_context') and
+      'forkserver' in multiprocessing.get_all_start_methods()):
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['TestCmd', 'TestCommon', 'TestGyp'])
+    return context
+  return multiprocessing
+
+
+def _terminate_worker(signum, frame):
+  # Remove the work directories of an in-process test that is being cut
+  # short, as its atexit handler would, then go away without unwinding.
+  TestCmd = sys.modules.get('TestCmd')
+  if TestCmd:
+    TestCmd._clean()
+  os._exit(1)
+
+
+def _init_worker():
+  # Let the main process handle Ctrl-C and tear down the pool.  This is a
+  # no-op handler rather than SIG_IGN: ignored signals stay ignored across
+  # exec, which would leave the builds and tools a test starts running.
+  signal.signal(signal.SIGINT, lambda signum, frame: None)
+  signal.signal(signal.SIGTERM, _terminate_worker)
+
+
+def _read_log(output):
+  """Returns the log a test wrote into the file output.
+
+  Only the end of the log decides whether it gets shown at all, so that is
+  looked at before reading and decoding all of it.  Logs of passed and
+  skipped tests come back empty.
+  """
+  output.seek(0, os.SEEK_END)
+  output.seek(max(0, output.tell() - 16))
+  if output.read().endswith(_QUIET_ENDINGS):
+    return ''
+  output.seek(0)
+  log = output.read()
+  if not isinstance(log, str):
+    # python 3; on python 2 the bytes can be printed as they are.
+    log = log.decode('utf8', 'replace')
+  return log
+
+
+def _open_log_writer(fd):
+  """Returns a file object for python code to write a test's log to fd."""
+  if sys.version_info[0] < 3:
+    return os.fdopen(os.dup(fd), 'w', 0)
+  return io.open(fd, 'w', buffering=1, encoding='utf8', closefd=False)
+
+
+def _spawn_test(cmd, env):
+  """Runs a test in a fresh python process, returns (returncode, stdout)."""
+  # Let the test write straight into a file rather than a pipe that has to
+  # be drained as it goes; a chatty test then never blocks on a full pipe.
+  with tempfile.TemporaryFile() as output:
+    proc = subprocess.Popen(cmd, stdout=output,
+                            stderr=subprocess.STDOUT, env=env)
+    proc.wait()
+    return proc.returncode, _read_log(output)
+
+
+def _exec_test(cmd, env):
+  """Runs a test inside the current process, returns (returncode, stdout).
+
+  This saves the python startup cost of _spawn_test().  The interpreter
+  state a test script is known to touch (argv, sys.path, stdio, the
+  environment and the current directory) is restored afterwards, and
+  modules imported from the test's own directory are dropped so the next
+  test doesn't pick them up.  Tests that leak other global state need
+  --isolate.
+
+  File descriptors 1 and 2 are pointed at the log for the duration of the
+  test, so that output from the processes it starts ends up in the log as
+  it would with _spawn_test(), rather than on the runner's terminal.
+  """
+  test = cmd[1]
+  test_dir = os.path.dirname(os.path.abspath(test))
+  saved_argv = sys.argv
+  saved_path = sys.path[:]
+  saved_modules = set(sys.modules)
+  saved_stdout = sys.stdout
+  saved_stderr = sys.stderr
+  saved_fds = None
+  saved_environ = os.environ.copy()
+  saved_cwd = os.getcwd()
+
+  output = tempfile.TemporaryFile()
+  log = None
+  returncode = 0
+  try:
+    sys.argv = cmd[1:]
+    # Mirror what the interpreter does for a script and for $PYTHONPATH.
+    pythonpath = [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+    sys.path[0:0] = [test_dir] + pythonpath
+    os.environ.clear()
+    os.environ.update(env)
+
+    saved_stdout.flush()
+    saved_stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno(), 2)
+    log = _open_log_writer(output.fileno())
+    sys.stdout = sys.stderr = log
+    try:
+      runpy.run_path(test, run_name='__main__')
+    except SystemExit as e:
+      if e.code is None:
+        returncode = 0
+      elif isinstance(e.code, int):
+        returncode = e.code
+      else:
+        log.write('%s\n' % e.code)
+        returncode = 1
+    except Exception:
+      traceback.print_exc(file=log)
+      returncode = 1
+    finally:
+      # Remove the work directories as TestCmd's atexit handler would.
+      TestCmd = sys.modules.get('TestCmd')
+      if TestCmd:
+        TestCmd._clean()
+  finally:
+    if log:
+      log.close()
+    if saved_fds:
+      os.dup2(saved_fds[0], 1)
+      os.dup2(saved_fds[1], 2)
+      os.close(saved_fds[0])
+      os.close(saved_fds[1])
+    sys.stdout = saved_stdout
+    sys.stderr = saved_stderr
+    os.chdir(saved_cwd)
+    os.environ.clear()
+    os.environ.update(saved_environ)
+    sys.path[:] = saved_path
+    sys.argv = saved_argv
+    for name in set(sys.modules) - saved_modules:
+      module_file = getattr(sys.modules[name], '__file__', None) or ''
+      if os.path.dirname(os.path.abspath(module_file)) == test_dir:
+        del sys.modules[name]
+
+  with output:
+    return returncode, _read_log(output)
+
+
+def _run_test(job):
+  """Runs a single test and returns (test, fmt, returncode, stdout, took).
+
+  This is executed in a worker process.  Workers inherit the runner's
+  environment when they start, so only TESTGYP_FORMAT is set here instead
+  of shipping a copy of the whole environment with every job.
+  """
+  cmd, fmt, isolate = job
+  test = cmd[1]
+  env = os.environ.copy()
+  env['TESTGYP_FORMAT'] = fmt
+  start = time.time()
+  if isolate:
+    returncode, stdout = _spawn_test(cmd, env)
+  else:
+    returncode, stdout = _exec_test(cmd, env)
+  took = time.time() - start
+  return test, fmt, returncode, stdout, took
+
+
 class Runner(object):
-  def __init__(self, formats, tests, gyp_options, verbose):
+  def __init__(self, formats, tests, gyp_options, verbose, jobs=1,
+               isolate=False):
     self.formats = formats
     self.tests = tests
     self.verbose = verbose
     self.gyp_options = gyp_options
+    self.jobs = max(1, jobs)
+    self.isolate = isolate
     self.failures = []
     self.num_tests = len(formats) * len(tests)
     num_digits = len(str(self.num_tests))
-    self.fmt_str = '[%%%dd/%%%dd] (%%s) %%s' % (num_digits, num_digits)
+    # The total never changes, so bake it in rather than formatting it
+    # again for every test.
+    self.fmt_str = '[%%%dd/%d] (%%s) %%s' % (num_digits, self.num_tests)
     self.isatty = sys.stdout.isatty() and not self.verbose
-    self.env = os.environ.copy()
     self.hpos = 0
 
   def run(self):
     run_start = time.time()
 
-    i = 1
+    # A test's command line is the same for every format, so build each one
+    # once and share it between the jobs.
+    cmds = [[sys.executable, test] + self.gyp_options for test in self.tests]
+    jobs = []
     for fmt in self.formats:
-      for test in self.tests:
-        self.run_test(test, fmt, i)
+      for cmd in cmds:
+        jobs.append((cmd, fmt, self.isolate))
+
+    timings = self.load_timings()
+
+    pool = None
+    if self.jobs == 1:
+      # Say which test is running before starting it, so that a hung test
+      # can be spotted.
+      def run_serially():
+        i = 1
+        for job in jobs:
+          cmd, fmt, _ = job
+          self.print_header(i, cmd[1], fmt)
+          sys.stdout.flush()
+          yield _run_test(job)
+          i += 1
+      results = run_serially()
+    else:
+      # Hand out the longest tests first so that a slow test (or format)
+      # doesn't end up running alone at the end while the other workers
+      # sit idle.
+      def expected_duration(job):
+        cmd, fmt, _ = job
+        return timings.get(fmt, {}).get(cmd[1], _DEFAULT_TIMING)
+      jobs.sort(key=expected_duration, reverse=True)
+      pool = _pool_context().Pool(min(self.jobs, len(jobs) or 1),
+                                  _init_worker)
+      results = pool.imap_unordered(_run_test, jobs)
+
+    try:
+      i = 1
+      for test, fmt, returncode, stdout, took in results:
+        if pool:
+          # Tests finish in any order, so only name them once they're done.
+          self.print_header(i, test, fmt)
+        self.print_result(test, fmt, returncode, stdout, took)
+        timings.setdefault(fmt, {})[test] = took
         i += 1
+    except KeyboardInterrupt:
+      if pool:
+        pool.terminate()
+        pool = None
+      raise
+    finally:
+      if pool:
+        pool.close()
+        pool.join()
 
     if self.isatty:
       self.erase_current_line()
 
+    self.save_timings(timings)
     self.took = time.time() - run_start
 
-  def run_test(self, test, fmt, i):
+  def load_timings(self):
+    try:
+      with open(_TIMINGS_FILE) as f:
+        timings = json.load(f)
+    except (IOError, ValueError):
+      return {}
+    if not isinstance(timings, dict):
+      return {}
+    # The file is only a hint and may be stale or edited by hand, so keep
+    # just the entries that have the expected shape.
+    result = {}
+    for fmt, tests in timings.items():
+      if not isinstance(tests, dict):
+        continue
+      result[fmt] = dict((test, took) for test, took in tests.items()
+                         if isinstance(took, (int, float)) and
+                            not isinstance(took, bool))
+    return result
+
+  def save_timings(self, timings):
+    try:
+      with open(_TIMINGS_FILE, 'w') as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+    except IOError:
+      # Timings are only a scheduling hint, so don't fail the run over them.
+      pass
+
+  def print_header(self, i, test, fmt):
+    msg = self.fmt_str % (i, fmt, test)
+    erase = ''
     if self.isatty:
-      self.erase_current_line()
+      erase = '\b' * self.hpos + ' ' * self.hpos + '\b' * self.hpos
+    sys.stdout.write(erase + msg)
+    self.hpos = len(msg)
 
-    msg = self.fmt_str % (i, self.num_tests, fmt, test)
-    self.print_(msg)
-
-    start = time.time()
-    cmd = [sys.executable, test] + self.gyp_options
-    self.env['TESTGYP_FORMAT'] = fmt
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT, env=self.env)
-    proc.wait()
-    took = time.time() - start
-
-    stdout = proc.stdout.read().decode('utf8')
-    if proc.returncode == 2:
+  def print_result(self, test, fmt, returncode, stdout, took):
+    if returncode == 2:
       res = 'skipped'
-    elif proc.returncode:
+    elif returncode:
       res = 'failed'
       self.failures.append('(%s) %s' % (test, fmt))
     else:
       res = 'passed'
-    res_msg = ' %s %.3fs' % (res, took)
-    self.print_(res_msg)
+    msg = ' %s %.3fs' % (res, took)
 
-    if (stdout and
-        not stdout.endswith('PASSED\n') and
-        not (stdout.endswith('NO RESULT\n'))):
-      print()
-      for l in stdout.splitlines():
-        print('    %s' % l)
+    # The workers have already dropped the logs of passed and skipped tests.
+    if stdout:
+      # Indent the whole log; failing tests can produce a lot of output.
+      msg += '\n    ' + '\n    '.join(stdout.splitlines()) + '\n'
     elif not self.isatty:
-      print()
+      msg += '\n'
 
-  def print_(self, msg):
-    print(msg, end='')
+    # Emit the rest of the result with a single write and flush, so the
+    # terminal is touched once per test however much there is to say.
+    sys.stdout.write(msg)
+    sys.stdout.flush()
     index = msg.rfind('\n')
     if index == -1:
       self.hpos += len(msg)
     else:
-      self.hpos = len(msg) - index
-    sys.stdout.flush()
+      self.hpos = len(msg) - index - 1
 
   def erase_current_line(self):
     print('\b' * self.hpos + ' ' * self.hpos + '\b' * self.hpos, end='')
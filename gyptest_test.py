@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the gyptest.py file."""
+
+import gyptest
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+
+class FakeDirEntry(object):
+  def __init__(self, path, contents):
+    self.name = os.path.basename(path)
+    self.path = path
+    self.contents = contents
+
+  def is_dir(self, follow_symlinks=True):
+    return isinstance(self.contents, dict)
+
+  def is_file(self, follow_symlinks=True):
+    return not self.is_dir()
+
+
+class FakeScandirIterator(list):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+
+class FakeFileSystem(object):
+  """An in-memory tree of nested dicts, browsable with scandir()."""
+  def __init__(self, root, tree):
+    self.root = root
+    self.tree = tree
+
+  def scandir(self, directory):
+    contents = self.tree
+    for part in os.path.relpath(directory, self.root).split(os.sep):
+      if part != os.curdir:
+        contents = contents[part]
+    return FakeScandirIterator(
+        FakeDirEntry(os.path.join(directory, name), contents[name])
+        for name in contents)
+
+
+class TestFindAllGyptestFiles(unittest.TestCase):
+  def find(self, tree):
+    fs = FakeFileSystem('test', tree)
+    return gyptest.find_all_gyptest_files('test', _scandir=fs.scandir)
+
+  def test_Recursive(self):
+    """Test that tests are found in subdirectories, sorted by path."""
+    tree = {
+        'b': {
+            'gyptest-b.py': None,
+            'deep': {'gyptest-deep.py': None},
+        },
+        'a': {'gyptest-a.py': None},
+        'gyptest-top.py': None,
+    }
+    self.assertEqual(self.find(tree), [
+        os.path.join('test', 'a', 'gyptest-a.py'),
+        os.path.join('test', 'b', 'deep', 'gyptest-deep.py'),
+        os.path.join('test', 'b', 'gyptest-b.py'),
+        os.path.join('test', 'gyptest-top.py'),
+    ])
+
+  def test_NonTests(self):
+    """Test that files and directories not named like tests are ignored."""
+    tree = {
+        'gyptest-a.gyp': None,
+        'helper.py': None,
+        'gyptest-dir.py': {'gyptest-a.py': None},
+    }
+    self.assertEqual(self.find(tree), [
+        os.path.join('test', 'gyptest-dir.py', 'gyptest-a.py'),
+    ])
+
+  def test_SkippedDirs(self):
+    """Test that version control directories aren't searched."""
+    tree = {
+        '.git': {'gyptest-git.py': None},
+        '.svn': {'gyptest-svn.py': None},
+        'gyptest-a.py': None,
+    }
+    self.assertEqual(self.find(tree), [os.path.join('test', 'gyptest-a.py')])
+
+
+class TestReadLog(unittest.TestCase):
+  def read_log(self, contents):
+    with tempfile.TemporaryFile() as output:
+      output.write(contents)
+      return gyptest._read_log(output)
+
+  def test_Quiet(self):
+    """Test that logs of passing and skipped tests aren't shown."""
+    self.assertEqual(self.read_log(b'running...\nPASSED\n'), '')
+    self.assertEqual(self.read_log(b'running...\nNO RESULT\n'), '')
+    self.assertEqual(self.read_log(b''), '')
+
+  def test_Failed(self):
+    """Test that the whole log of a failing test is returned as text."""
+    log = b'running the first step...\nrunning the second step...\nFAILED\n'
+    self.assertTrue(len(log) > 16)
+    self.assertEqual(self.read_log(log), log.decode('utf8'))
+
+
+class TestExecTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def exec_test(self, source, env=None):
+    test = os.path.join(self.tempdir, 'gyptest-exec.py')
+    with open(test, 'w') as f:
+      f.write(source)
+    if env is None:
+      env = os.environ.copy()
+    return gyptest._exec_test([sys.executable, test, '-G', 'a=b'], env)
+
+  def test_ReturnCodes(self):
+    """Test that the ways a test can end map to the right return code."""
+    self.assertEqual(self.exec_test('pass\n'), (0, ''))
+    self.assertEqual(
+        self.exec_test('import sys\nsys.stderr.write("PASSED\\n")\n'),
+        (0, ''))
+    self.assertEqual(self.exec_test('import sys\nsys.exit()\n'), (0, ''))
+    self.assertEqual(self.exec_test('import sys\nsys.exit(2)\n'), (2, ''))
+    self.assertEqual(self.exec_test('import sys\nsys.exit("oops")\n'),
+                     (1, 'oops\n'))
+    returncode, log = self.exec_test('raise ValueError("boom")\n')
+    self.assertEqual(returncode, 1)
+    self.assertTrue(log.startswith('Traceback'))
+    self.assertTrue(log.endswith('ValueError: boom\n'))
+
+  def test_StateRestored(self):
+    """Test that the state a test changes is put back afterwards."""
+    argv = sys.argv[:]
+    path = sys.path[:]
+    environ = os.environ.copy()
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    stderr = sys.stderr
+    fds = [os.fstat(1), os.fstat(2)]
+
+    env = os.environ.copy()
+    env['GYPTEST_TEST_VAR'] = 'set'
+    returncode, log = self.exec_test(
+        'import os, sys\n'
+        'assert sys.argv[1:] == ["-G", "a=b"], sys.argv\n'
+        'assert os.environ["GYPTEST_TEST_VAR"] == "set"\n'
+        'sys.argv.append("extra")\n'
+        'sys.path.append("extra")\n'
+        'os.environ["GYPTEST_OTHER_VAR"] = "set"\n'
+        'os.chdir(os.path.dirname(os.getcwd()))\n'
+        'sys.exit(1)\n',
+        env)
+    self.assertEqual((returncode, log), (1, ''))
+
+    self.assertEqual(sys.argv, argv)
+    self.assertEqual(sys.path, path)
+    self.assertEqual(dict(os.environ), dict(environ))
+    self.assertEqual(os.getcwd(), cwd)
+    self.assertTrue(sys.stdout is stdout)
+    self.assertTrue(sys.stderr is stderr)
+    for fd, stat in zip((1, 2), fds):
+      self.assertEqual((os.fstat(fd).st_dev, os.fstat(fd).st_ino),
+                       (stat.st_dev, stat.st_ino))
+
+  def test_ChildOutput(self):
+    """Test that output of processes the test starts ends up in the log."""
+    returncode, log = self.exec_test(
+        'import subprocess, sys\n'
+        'print("parent log")\n'
+        'subprocess.call([sys.executable, "-c",\n'
+        '                 "import sys; sys.stderr.write(\'child log\\\\n\')"])\n'
+        'sys.exit(1)\n')
+    self.assertEqual((returncode, log), (1, 'parent log\nchild log\n'))
+
+  def test_LocalModulesDropped(self):
+    """Test that modules imported from the test's directory are dropped."""
+    with open(os.path.join(self.tempdir, 'gyptest_exec_helper.py'), 'w') as f:
+      f.write('VALUE = 1\n')
+    returncode, log = self.exec_test(
+        'import gyptest_exec_helper\n'
+        'assert gyptest_exec_helper.VALUE == 1\n')
+    self.assertEqual((returncode, log), (0, ''))
+    self.assertFalse('gyptest_exec_helper' in sys.modules)
+
+
+class TestLoadTimings(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.tempdir = tempfile.mkdtemp()
+    os.chdir(self.tempdir)
+    self.runner = gyptest.Runner(['make'], [], [], False)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.tempdir)
+
+  def load(self, contents):
+    with open(gyptest._TIMINGS_FILE, 'w') as f:
+      f.write(contents)
+    return self.runner.load_timings()
+
+  def test_Valid(self):
+    """Test that well-formed timings are loaded as they are."""
+    self.assertEqual(self.load('{"make": {"a.py": 2.5, "b.py": 1}}'),
+                     {'make': {'a.py': 2.5, 'b.py': 1}})
+
+  def test_Missing(self):
+    """Test that a missing timings file means no timings."""
+    self.assertEqual(self.runner.load_timings(), {})
+
+  def test_Malformed(self):
+    """Test that entries of the wrong shape are dropped."""
+    self.assertEqual(self.load('not json'), {})
+    self.assertEqual(self.load('[1, 2]'), {})
+    self.assertEqual(self.load('{"make": 5}'), {})
+    self.assertEqual(
+        self.load('{"make": {"a.py": "x", "b.py": true, "c.py": 3}}'),
+        {'make': {'c.py': 3}})
+
+
+class TestMain(unittest.TestCase):
+  def setUp(self):
+    self.environ = os.environ.copy()
+    self.stdout = sys.stdout
+    sys.stdout = StringIO()
+
+  def tearDown(self):
+    sys.stdout = self.stdout
+    os.environ.clear()
+    os.environ.update(self.environ)
+
+  def run_main(self, *args):
+    # -l makes main() list the tests and exit before running anything.
+    argv = ['gyptest.py', '-l'] + list(args) + ['test/gyptest-dummy.py']
+    with self.assertRaises(SystemExit) as cm:
+      gyptest.main(argv)
+    self.assertEqual(cm.exception.code, 0)
+
+  def test_Path(self):
+    """Test that --path directories are prepended to $PATH."""
+    old_path = os.environ['PATH']
+    self.run_main('--path', 'foo')
+    self.assertEqual(os.environ['PATH'],
+                     os.path.abspath('foo') + os.pathsep + old_path)
+
+  def test_PathDuplicates(self):
+    """Test that a directory passed to --path twice is only added once."""
+    old_path = os.environ['PATH']
+    self.run_main('--path', 'foo', '--path', 'bar', '--path', 'foo')
+    expected = [os.path.abspath('foo'), os.path.abspath('bar'), old_path]
+    self.assertEqual(os.environ['PATH'], os.pathsep.join(expected))
+
+
+if __name__ == '__main__':
+  unittest.main()
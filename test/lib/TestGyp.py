@@ -122,6 +122,20 @@ class TestGypBase(TestCommon.TestCommon):
 
     self.formats = [self.format]
 
+    formats = kw.pop('formats', [])
+    real_format = self.format.split('-')[-1]
+    excluded_formats = set([f for f in formats if f[0] == '!'])
+    included_formats = set(formats) - excluded_formats
+    if ('!'+real_format in excluded_formats or
+        included_formats and real_format not in included_formats):
+      # Skip before looking for the build tool or setting up a work area,
+      # neither of which this test would use.  TestCommon.__init__ insists
+      # on a workdir to chdir into, so only initialize the TestCmd part.
+      kw['workdir'] = None
+      TestCmd.TestCmd.__init__(self, *args, **kw)
+      msg = 'Invalid test for %r format; skipping test.\n'
+      self.skip_test(msg % self.format)
+
     self.initialize_build_tool()
 
     kw.setdefault('match', TestCommon.match_exact)
@@ -129,24 +143,14 @@ class TestGypBase(TestCommon.TestCommon):
     # Put test output in out/testworkarea by default.
     # Use temporary names so there are no collisions.
     workdir = os.path.join('out', kw.get('workdir', 'testworkarea'))
-    # Create work area if it doesn't already exist.
-    if not os.path.isdir(workdir):
-      os.makedirs(workdir)
+    # Create work area if it doesn't already exist.  Tests may run in
+    # parallel, so another one could be creating it at the same time.
+    MakeDirs(workdir)
 
     kw['workdir'] = tempfile.mktemp(prefix='testgyp.', dir=workdir)
 
-    formats = kw.pop('formats', [])
-
     super(TestGypBase, self).__init__(*args, **kw)
 
-    real_format = self.format.split('-')[-1]
-    excluded_formats = set([f for f in formats if f[0] == '!'])
-    included_formats = set(formats) - excluded_formats
-    if ('!'+real_format in excluded_formats or
-        included_formats and real_format not in included_formats):
-      msg = 'Invalid test for %r format; skipping test.\n'
-      self.skip_test(msg % self.format)
-
     self.copy_test_configuration(self.origin_cwd, self.workdir)
     self.set_configuration(None)
 